@@ -0,0 +1,40 @@
+import json, subprocess, sys, time, statistics
+
+def bench_import(runs=20):
+	# fresh interpreter per run, the offline render path must not pull in the server stack
+	code = "import table, sys; print(','.join(m for m in ('asyncio', 'websockets', 'http.server', 'socketserver', 'webbrowser', 'server') if m in sys.modules))"
+	times = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+		times.append(time.perf_counter() - start)
+	base = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, "-c", "pass"], check=True)
+		base.append(time.perf_counter() - start)
+	print(f"import table: {(statistics.median(times) - statistics.median(base)) * 1000:.1f} ms over bare interpreter startup")
+	if out:
+		print(f"  warning: server modules imported: {out}")
+
+def bench_serialize(sheets=20, width=30, height=3000):
+	from table import SpreadSheet
+	sheet = SpreadSheet()
+	for i in range(sheets):
+		sheet.createSheet(f"sheet{i}")
+		table = sheet.sheets[i].table
+		table._expand_to_include(width - 1, height - 1)
+		for x, col in enumerate(table.data):
+			for y, cell in enumerate(col):
+				cell.value = x * y
+		table[0:3][0:100].style.background = "#eee"
+	start = time.perf_counter()
+	out = sheet.serialize()
+	print(f"serialize {sheets}x{width}x{height}: {time.perf_counter() - start:.2f} s, {len(out) / 1e6:.1f} MB")
+	start = time.perf_counter()
+	out = json.dumps(sheet.payload(), separators=(",", ":"))
+	print(f"payload {sheets}x{width}x{height}: {time.perf_counter() - start:.2f} s, {len(out) / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+	bench_import()
+	bench_serialize()
@@ -1,4 +1,5 @@
-from table import SpreadSheet, Server
+from table import SpreadSheet
+from server import Server
 from time import sleep
 
 sheet = SpreadSheet()
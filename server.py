@@ -0,0 +1,195 @@
+import http.server, socketserver, threading, webbrowser, json, os
+from urllib.parse import urlparse
+import asyncio, websockets
+import atexit
+import socket
+
+class Server:
+	def __init__(self, spreadsheet, port=80, client_render=False):
+		self.sheet = spreadsheet
+		self.port = port
+		self.client_render = client_render  # serve a static shell + /data payload instead of server rendered html
+		self.clients = set()
+		self.scroll_pos = (0, 0)
+		self.inc_file = None
+		self.http_thread = None
+		self.ws_thread = None
+		self.loop = asyncio.new_event_loop()
+		self._needs_reload = False
+		self.should_stop = False
+		self._host = None
+		spreadsheet.server = self
+		atexit.register(self.stop)
+
+	@property
+	def host(self):
+		# resolved once, the lookup can hit DNS
+		if self._host is None:
+			self._host = socket.gethostbyname(socket.gethostname())
+		return self._host
+
+	def update_shortcut(self, file):
+		ip = self.host
+		f = open(file, "w")
+		f.write(f"<!doctype HTML><html><head><meta http-equiv=\"refresh\" content=\"1;url=http://{ip}:{self.port}\"></head><body><h1>redirection</h1><p>if this page doesnt redirect, click on <a href=\"http://{ip}:{self.port}\">this link</a></p></body></html>")
+		f.close()
+
+	def open_in_browser(self, wait=0):
+		webbrowser.open(f"http://{self.host}:{self.port}")
+		if wait:
+			import time
+			time.sleep(wait)
+
+	def start(self):
+		self._start_http_server()
+		self._start_websocket_server()
+
+	def _websocket_script(self):
+		return f"""
+	<script>
+	let ws = new WebSocket(`ws://${{location.hostname}}:{self.port+1}`);
+	ws.onmessage = msg => {{
+		let data = JSON.parse(msg.data);
+		console.log(data)
+		if (data.type === "update") {{
+			data.cells.forEach(cell => {{
+				let table = document.querySelector("table.T" + cell.sheet);
+				let row = table && table.rows[cell.y + 1];
+				let el = row && row.cells[cell.x + 1];
+				if (el) {{
+					el.textContent = cell.value;
+					el.style.background = cell.style.bg;
+					el.style.color = cell.style.color;
+				}} else if (window.sheetPending) {{
+					window.sheetPending(cell);  // client rendered page, the row is built later
+				}} else {{
+					console.log("out of range: Cell(" + cell.x + "," + cell.y + ")"); 
+				}}
+			}});
+		}} else if (data.type === "reload") {{
+			location.reload();
+		}} else if (data.type === "scroll") {{
+			document.querySelectorAll(".TBC").forEach(e => {{
+			e.scrollLeft = data.x;
+			e.scrollTop = data.y;
+			}});
+		}}
+	}};
+	</script>
+	"""
+
+	def _start_http_server(self):
+		class Handler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.server_instance.client_render and urlparse(self.path).path == "/data":
+					data = json.dumps(self.server_instance.sheet.payload(), separators=(",", ":"))
+					self.send_response(200)
+					self.send_header("Content-type", "application/json")
+					self.end_headers()
+					self.wfile.write(data.encode("utf8"))
+					return
+
+				if self.server_instance.client_render:
+					html = "<!DOCTYPE html>" + self.server_instance.sheet.shell("/data")
+				else:
+					html = "<!DOCTYPE html>" + self.server_instance.sheet.serialize()
+				if self.server_instance.inc_file and os.path.exists(self.server_instance.inc_file):
+					with open(self.server_instance.inc_file, 'r', encoding='utf8') as f:
+						html += f.read()
+				html += self.server_instance._websocket_script()
+
+				self.send_response(200)
+				self.send_header("Content-type", "text/html")
+				self.end_headers()
+				self.wfile.write(html.encode("utf8"))
+
+			def log_message(self, format, *args):
+				return  # silence default logging
+	
+		# We need a way for Handler to access 'self', so assign a reference
+		Handler.server_instance = self
+	
+		self.http_thread = threading.Thread(
+			target=lambda: socketserver.TCPServer(("0.0.0.0", self.port), Handler).serve_forever(),
+			daemon=True
+		)
+		self.http_thread.start()
+
+
+	def _start_websocket_server(self):
+		async def ws_handler(websocket):
+			self.clients.add(websocket)
+			try:
+				full = {"type": "full", "scroll": self.scroll_pos}
+				if not self.client_render:
+					# client rendered pages already fetched /data, do not render the sheet again per connection
+					full["html"] = self.sheet.serialize()
+				await websocket.send(json.dumps(full))
+				while True:
+					msg = await websocket.recv()
+					# handle messages here if needed
+			except:
+				pass
+			finally:
+				self.clients.remove(websocket)
+	
+		async def run_ws():
+			async with websockets.serve(ws_handler, "0.0.0.0", self.port+1):
+				await asyncio.Future()  # run forever
+	
+		self.ws_thread = threading.Thread(target=self.loop.run_until_complete, args=(run_ws(),), daemon=True)
+		self.ws_thread.start()
+
+
+	def update(self):
+		print("needs reload:", self.needs_reload)
+		if self.needs_reload == True:
+			print("reloading")
+			self.needs_reload = False
+			for a,b,cell in self.sheet.sheets[0].table[:][:].superRange:
+				cell.dirty = False
+			self.reload()
+		else:
+			print("updating")
+			updates = []
+			for x, y, cell in self.sheet.sheets[0].table[:][:].superRange:
+				if getattr(cell, "dirty", False):
+					print("dirty:", (x,y))
+					updates.append({
+						"x": x, "y": y,
+						"sheet": 1,
+						"value": cell.value,
+						"style": {
+							"bg": cell.style.background,
+							"color": cell.style.color
+						}
+					})
+					cell.dirty = False
+
+
+			if len(updates):
+				message = json.dumps({"type": "update", "cells": updates})
+				asyncio.run_coroutine_threadsafe(self._broadcast(message), self.loop)
+
+	def setClientScroll(self, x, y):
+		self.scroll_pos = (x, y)
+		message = json.dumps({"type": "scroll", "x": x, "y": y})
+		asyncio.run_coroutine_threadsafe(self._broadcast(message), self.loop)
+
+	def reload(self):
+		asyncio.run_coroutine_threadsafe(self._broadcast(json.dumps({"type": "reload"})), self.loop)
+
+	def stop(self):
+		self.should_stop = True
+		for task in asyncio.all_tasks(loop=self.loop):
+			task.cancel()
+
+	async def _broadcast(self, msg):
+		dead = []
+		for client in self.clients:
+			try:
+				await client.send(msg)
+			except:
+				dead.append(client)
+		for c in dead:
+			self.clients.remove(c)
@@ -1,181 +1,222 @@
 from typing import Any, List, Tuple, Iterator, Union
 import html
+import functools, heapq, json, math, operator, re, sys, weakref
+from collections import Counter, deque
+from contextlib import contextmanager
 
-import traceback
-
-import http.server, socketserver, threading, webbrowser, json, os
-from urllib.parse import urlparse
-import asyncio, websockets
-import atexit
-
-class Server:
-	def __init__(self, spreadsheet, port=80):
-		self.sheet = spreadsheet
-		self.port = port
-		self.clients = set()
-		self.scroll_pos = (0, 0)
-		self.inc_file = None
-		self.http_thread = None
-		self.ws_thread = None
-		self.loop = asyncio.new_event_loop()
-		self._needs_reload = False
-		self.should_stop = False
-		spreadsheet.server = self
-		atexit.register(self.stop)
-
-	def update_shortcut(self, file):
-		import socket
-		ip = socket.gethostbyname(socket.gethostname())
-		f = open(file, "w")
-		f.write(f"<!doctype HTML><html><head><meta http-equiv=\"refresh\" content=\"1;url=http://{ip}:{self.port}\"></head><body><h1>redirection</h1><p>if this page doesnt redirect, click on <a href=\"http://{ip}:{self.port}\">this link</a></p></body></html>")
-		f.close()
-
-	def open_in_browser(self):
-		import socket
-		ip = socket.gethostbyname(socket.gethostname())
-		webbrowser.open(f"http://{ip}:{self.port}")
-		import time
-		time.sleep(5)
-
-	def start(self):
-		self._start_http_server()
-		self._start_websocket_server()
-
-	def _websocket_script(self):
-		return f"""
-	<script>
-	let ws = new WebSocket(`ws://${{location.hostname}}:{self.port+1}`);
-	ws.onmessage = msg => {{
-		let data = JSON.parse(msg.data);
-		console.log(data)
-		if (data.type === "update") {{
-			data.cells.forEach(cell => {{
-				let el = document.getElementById(cell.id);
-				if (el) {{
-					el.textContent = cell.value;
-					el.style.background = cell.style.bg;
-					el.style.color = cell.style.color;
-				}} else {{
-					console.log("out of range: Cell(" + cell.x + "," + cell.y + ")"); 
-				}}
-			}});
-		}} else if (data.type === "reload") {{
-			location.reload();
-		}} else if (data.type === "scroll") {{
-			document.querySelectorAll(".TBC").forEach(e => {{
-			e.scrollLeft = data.x;
-			e.scrollTop = data.y;
-			}});
-		}}
-	}};
-	</script>
-	"""
-
-	def _start_http_server(self):
-		class Handler(http.server.BaseHTTPRequestHandler):
-			def do_GET(self):
-				html = "<!DOCTYPE html>" + self.server_instance.sheet.serialize()
-				if self.server_instance.inc_file and os.path.exists(self.server_instance.inc_file):
-					with open(self.server_instance.inc_file, 'r', encoding='utf8') as f:
-						html += f.read()
-				html += self.server_instance._websocket_script()
-
-				self.send_response(200)
-				self.send_header("Content-type", "text/html")
-				self.end_headers()
-				self.wfile.write(html.encode("utf8"))
-
-			def log_message(self, format, *args):
-				return  # silence default logging
-	
-		# We need a way for Handler to access 'self', so assign a reference
-		Handler.server_instance = self
-	
-		self.http_thread = threading.Thread(
-			target=lambda: socketserver.TCPServer(("0.0.0.0", self.port), Handler).serve_forever(),
-			daemon=True
-		)
-		self.http_thread.start()
+def __getattr__(name):
+	# the server stack (asyncio, websockets, http.server) is only imported when asked for
+	if name == "Server":
+		from server import Server
+		return Server
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+def number_to_excel_col(n):
+	result = ""
+	while n > 0:
+		n -= 1  # Adjust because Excel columns are 1-based but modulo is 0-based
+		result = chr((n % 26) + ord('A')) + result
+		n //= 26
+	return result
 
-	def _start_websocket_server(self):
-		async def ws_handler(websocket):
-			self.clients.add(websocket)
-			try:
-				await websocket.send(json.dumps({
-					"type": "full",
-					"html": self.sheet.serialize(),
-					"scroll": self.scroll_pos
-				}))
-				while True:
-					msg = await websocket.recv()
-					# handle messages here if needed
-			except:
-				pass
-			finally:
-				self.clients.remove(websocket)
-	
-		async def run_ws():
-			async with websockets.serve(ws_handler, "0.0.0.0", self.port+1):
-				await asyncio.Future()  # run forever
-	
-		self.ws_thread = threading.Thread(target=self.loop.run_until_complete, args=(run_ws(),), daemon=True)
-		self.ws_thread.start()
-
-
-	def update(self):
-		print("needs reload:", self.needs_reload)
-		if self.needs_reload == True:
-			print("reloading")
-			self.needs_reload = False
-			for a,b,cell in self.sheet.sheets[0].table[:][:].superRange:
-				cell.dirty = False
-			self.reload()
-		else:
-			print("updating")
-			updates = []
-			for x, y, cell in self.sheet.sheets[0].table[:][:].superRange:
-				if getattr(cell, "dirty", False):
-					print("dirty:", (x,y))
-					updates.append({
-						"x": x, "y": y,
-						"id": f"cell_{x}_{y}",
-						"value": cell.value,
-						"style": {
-							"bg": cell.style.background,
-							"color": cell.style.color
-						}
-					})
-					cell.dirty = False
+def excel_col_to_number(col):
+	# inverse of number_to_excel_col: "A" -> 1, "Z" -> 26, "AA" -> 27
+	n = 0
+	for c in col:
+		n = n * 26 + ord(c) - ord('A') + 1
+	return n
 
+_PAGE_CSS = (
+	"body {margin: 0; display: flex; flex-direction: row; height: 100vh; }"
+	".TBCC {min-width: 0; display: flex; flex-direction: row; margin: 10px; }"
+	".TBC {overflow:auto;margin:10px;scrollbar-width:none;-ms-overflow-style:none;}"
+	".TBC::-webkit-scrollbar{display:none;}"
+	"table {border-collapse:collapse;position:relative;overflow:clip;}"
+	"thead th{position:sticky;top:0;background:#eee;z-index:5;border-right:1px solid #aaa;padding:4px 8px;}"
+	"thead th::after{content:\"\";position:absolute;left:0;bottom:0;height:3px;width:103%;background:#aaa;z-index:-1;}"
+	"thead th:first-child{left:0;z-index:10;background:#eee;position:sticky;top:0;left:0;}"
+	"thead th:first-child::before{content:\"\";position:absolute;top:0;right:0;width:3px;height:100%;background:#aaa;z-index:1;}"
+	"tbody th{position:sticky;left:0;z-index:4;background:#eee;min-width:40px;text-align:center;border-bottom:1px solid #aaa;padding:4px 8px;}"
+	"tbody th::before{content:\"\";position:absolute;top:0;right:0;width:3px;height:100%;background:#aaa;z-index:1;}"
+	"tbody td{white-space:nowrap;border-bottom:1px solid #ccc;padding:4px 8px;}"
+)
 
-			if len(updates):
-				message = json.dumps({"type": "update", "cells": updates})
-				asyncio.run_coroutine_threadsafe(self._broadcast(message), self.loop)
+_CLIENT_SCRIPT = """<script>
+((src) => {
+	const letters = n => { let s = ""; while (n > 0) { n--; s = String.fromCharCode(65 + n % 26) + s; n = Math.floor(n / 26); } return s; };
+	// live updates for cells whose row is not built yet (or before /data arrived) wait here,
+	// the server clears its dirty flags after broadcasting and will not send them again
+	const pending = new Map();
+	window.sheetPending = cell => pending.set(cell.sheet + ":" + cell.x + ":" + cell.y, cell);
+	fetch(src).then(r => r.json()).then(data => {
+		let css = "tbody td{" + data.styles[0] + "}";
+		data.styles.forEach((s, i) => { if (i) css += ".S" + i + "{" + s + "}"; });
+		document.head.appendChild(document.createElement("style")).textContent = css;
+		let boxes = data.sheets.map((sheet, i) => {
+			let outer = document.body.appendChild(document.createElement("div"));
+			outer.className = "TBCC";
+			let box = outer.appendChild(document.createElement("div"));
+			box.className = "TBC " + (i + 1);
+			let table = box.appendChild(document.createElement("table"));
+			table.className = "T" + (i + 1);
+			let head = table.createTHead().insertRow();
+			head.appendChild(document.createElement("th"));
+			for (let x = 0; x < sheet.width; x++) head.appendChild(document.createElement("th")).textContent = letters(x + 1);
+			let body = table.createTBody();
+			let classes = sheet.styles.map(runs => { let ids = []; runs.forEach(([id, n]) => { while (n--) ids.push(id); }); return ids; });
+			// a block of rows per frame, the first screen shows before the whole sheet is in the DOM
+			let y = 0;
+			let block = () => {
+				let rows = document.createDocumentFragment();
+				for (let end = Math.min(y + 500, sheet.height); y < end; y++) {
+					let tr = rows.appendChild(document.createElement("tr"));
+					tr.appendChild(document.createElement("th")).textContent = y + 1;
+					for (let x = 0; x < sheet.width; x++) {
+						let td = tr.appendChild(document.createElement("td"));
+						let v = sheet.values[x][y];
+						if (v != null) td.textContent = v;
+						if (classes[x][y]) td.className = "S" + classes[x][y];
+						let key = (i + 1) + ":" + x + ":" + y;
+						let update = pending.get(key);
+						if (update) {
+							td.textContent = update.value;
+							td.style.background = update.style.bg;
+							td.style.color = update.style.color;
+							pending.delete(key);
+						}
+					}
+				}
+				body.appendChild(rows);
+				if (y < sheet.height) requestAnimationFrame(block);
+			};
+			block();
+			return box;
+		});
+		let syncing = false;
+		boxes.forEach(box => box.addEventListener("scroll", () => {
+			if (syncing) return;
+			syncing = true;
+			boxes.forEach(other => { if (other !== box) { other.scrollLeft = box.scrollLeft; other.scrollTop = box.scrollTop; } });
+			requestAnimationFrame(() => { syncing = false; });
+		}));
+	});
+})(DATA_URL);
+</script>"""
 
-	def setClientScroll(self, x, y):
-		self.scroll_pos = (x, y)
-		message = json.dumps({"type": "scroll", "x": x, "y": y})
-		asyncio.run_coroutine_threadsafe(self._broadcast(message), self.loop)
+def _freeze_style(style):
+	return (
+		style.border.left,
+		style.border.right,
+		style.border.top,
+		style.border.bottom,
+		style.background,
+		style.color,
+		style.font.size,
+		style.font.family,
+		style.font.modifiers,
+	)
 
-	def reload(self):
-		asyncio.run_coroutine_threadsafe(self._broadcast(json.dumps({"type": "reload"})), self.loop)
+def _style_to_css(style_key):
+	bl, br, bt, bb, bg, color, fsize, ffam, fmod = style_key
+	return (
+		f"background:{bg};"
+		f"color:{color};"
+		f"border-left:{bl};"
+		f"border-right:{br};"
+		f"border-top:{bt};"
+		f"border-bottom:{bb};"
+		f"font-family:{ffam};"
+		f"font-size:{fsize}px;"
+		f"font-style:{fmod};"
+	)
 
-	def stop(self):
-		self.should_stop = True
-		for task in asyncio.all_tasks(loop=self.loop):
-			task.cancel()
+_memory_trace = None   # operation -> [calls, bytes], only while trace_memory() is active
+_traced_active = set()  # operations currently on the stack, nested calls of the same one are not counted twice
 
-	async def _broadcast(self, msg):
-		dead = []
-		for client in self.clients:
+@contextmanager
+def trace_memory():
+	# opt-in: attributes the net traced memory growth of table operations to the operation.
+	# different operations nest inclusively (a "set" that grows the table also counts under "expand"),
+	# an operation inside itself (TableRange delegating to RecursiveAccessor) counts once.
+	# a nested trace_memory() collects on its own and hands back to the outer one when it exits
+	global _memory_trace
+	import tracemalloc
+	started = not tracemalloc.is_tracing()
+	if started:
+		tracemalloc.start()
+	previous = _memory_trace
+	_memory_trace = stats = {}
+	try:
+		yield stats
+	finally:
+		_memory_trace = previous
+		if started:
+			tracemalloc.stop()
+
+def _traced(operation):
+	def decorator(fn):
+		@functools.wraps(fn)
+		def traced(*args, **kwargs):
+			if _memory_trace is None or operation in _traced_active:
+				return fn(*args, **kwargs)
+			import tracemalloc
+			stats = _memory_trace.setdefault(operation, [0, 0])
+			_traced_active.add(operation)
+			before = tracemalloc.get_traced_memory()[0]
 			try:
-				await client.send(msg)
-			except:
-				dead.append(client)
-		for c in dead:
-			self.clients.remove(c)
+				return fn(*args, **kwargs)
+			finally:
+				_traced_active.discard(operation)
+				stats[0] += 1
+				stats[1] += tracemalloc.get_traced_memory()[0] - before
+		return traced
+	return decorator
+
+def _sizeof(obj, seen):
+	# shallow size plus instance __dict__, every object is counted once per report
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if hasattr(obj, "__dict__") and not isinstance(obj, type):
+		size += _sizeof(obj.__dict__, seen)
+	return size
 
+def _sizeof_formula(formula, seen):
+	if formula is None or id(formula) in seen:
+		return 0
+	size = _sizeof(formula, seen)
+	for value in getattr(formula, "__dict__", {}).values():
+		if isinstance(value, (str, int, float)):
+			size += _sizeof(value, seen)
+		elif isinstance(value, (list, tuple, dict, set)):
+			# Aggregate state: per cell (value, seq) entries and the heap
+			size += _sizeof(value, seen)
+			items = value.values() if isinstance(value, dict) else value
+			size += sum(_sizeof(item, seen) for item in items if isinstance(item, tuple))
+		elif callable(value) and not isinstance(value, SpreadSheet.Cell):
+			size += _sizeof_closure(value, seen)
+	return size
+
+def _sizeof_closure(fn, seen):
+	# compiled formulas are trees of closures, walk them through their cells
+	if id(fn) in seen or not hasattr(fn, "__closure__"):
+		return _sizeof_formula(fn, seen) if hasattr(fn, "__dict__") else 0
+	size = _sizeof(fn, seen)
+	for cell in fn.__closure__ or ():
+		size += _sizeof(cell, seen)
+		value = cell.cell_contents
+		if hasattr(value, "__closure__"):
+			size += _sizeof_closure(value, seen)
+		elif callable(value) and hasattr(value, "__dict__") and not isinstance(value, SpreadSheet.Cell):
+			# a Formula, Expression or Aggregate nested in a compiled formula
+			size += _sizeof_formula(value, seen)
+		elif isinstance(value, (str, int, float, tuple)):
+			size += _sizeof(value, seen)
+	for default in fn.__defaults__ or ():
+		if hasattr(default, "__closure__"):
+			size += _sizeof_closure(default, seen)
+	return size
 
 class SpreadSheet:
 	class BoundToCell:
@@ -191,6 +232,8 @@ class SpreadSheet:
 		pass
 	class Table:
 		pass
+	class TableRange:
+		pass
 	pass
 
 class SpreadSheet:
@@ -264,28 +307,50 @@ class SpreadSheet:
 			self._style = style if style is not None else SpreadSheet.Style()
 			self._style.cell = self
 			self._dirty = True
-			self.formula = None
+			self._formula = None
+			self.watchers = None  # weak references to the Aggregates bound to this cell
 		@property
 		def dirty(self):
-			if self.formula is None:
+			if self._formula is None:
 				return self._dirty
 			return True
 		@dirty.setter
 		def dirty(self, val):
-			if self.formula is not None:
+			if self._formula is not None:
 				self._dirty = True
 			self._dirty = val
 		@property
+		def formula(self):
+			return self._formula
+		@formula.setter
+		def formula(self, formula):
+			self._formula = formula
+			if self.watchers:
+				self._notify(self._value)
+		@property
 		def value(self):
-			if self.formula is not None:
-				return self.formula()
+			if self._formula is not None:
+				return self._formula()
 			return self._value
 		@value.setter
 		def value(self, val):
 			self.dirty = True
-			if self.formula is not None:
-				self.formula = None
+			if self._formula is not None:
+				self._formula = None
 			self._value = val
+			if self.watchers:
+				self._notify(val)
+		def _notify(self, value):
+			# an Aggregate dropped without unbind() is collected, its reference is pruned here
+			dead = False
+			for ref in self.watchers:
+				watcher = ref()
+				if watcher is None:
+					dead = True
+				else:
+					watcher.update(self, value)
+			if dead:
+				self.watchers = [ref for ref in self.watchers if ref() is not None] or None
 		@property
 		def style(self):
 			return self._style
@@ -306,38 +371,472 @@ class SpreadSheet:
 		sub=1
 		mult=2
 		div=3
+		_ops = (operator.add, operator.sub, operator.mul, operator.truediv)
 		def __init__(self, operation, a, b):
 			self.op = operation
 			self.a = a
 			self.b = b
+		def __setattr__(self, name, value):
+			object.__setattr__(self, name, value)
+			# recompile whenever the operator or an operand changes, once all three are set
+			if name in ('op', 'a', 'b') and 'op' in self.__dict__ and 'a' in self.__dict__ and 'b' in self.__dict__:
+				self.compile()
+		def compile(self):
+			# resolve the operator and operand access once instead of on every call
+			fn = SpreadSheet.Formula._ops[self.op]
+			a = SpreadSheet.Formula._operand(self.a)
+			b = SpreadSheet.Formula._operand(self.b)
+			self._call = lambda: fn(a(), b())
+			return self
+		@staticmethod
+		def _operand(x):
+			if isinstance(x, (SpreadSheet.Formula, SpreadSheet.Expression, SpreadSheet.Aggregate)):
+				return x
+			if isinstance(x, SpreadSheet.Cell):
+				return lambda: x.value
+			return lambda: x
 		def __call__(self):
-			a = self.a
-			b = self.b
-			if isinstance(self.a, SpreadSheet.Formula):
-				a = a()
-			elif isinstance(self.a, SpreadSheet.Cell):
-				a = a.value
-
-			if isinstance(self.b, SpreadSheet.Formula):
-				b = b()
-			elif isinstance(self.b, SpreadSheet.Cell):
-				b = b.value
-
-			match(self.op):
-				case SpreadSheet.Formula.add:
-					return a + b
-				case SpreadSheet.Formula.sub:
-					return a - b
-				case SpreadSheet.Formula.mult:
-					return a * b
-				case SpreadSheet.Formula.div:
-					return a / b
+			return self._call()
+	class Expression:
+		# formula text like "=SUM(A1:A10)*2 + B3", parsed once into a tree of closures.
+		# references use the header names: column letters and 1-based row numbers
+		_token = re.compile(
+			r'\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)'  # number
+			r'|"([^"]*)"'                                            # string
+			r'|([A-Za-z_][A-Za-z0-9_]*)(?=\s*\()'                     # function name, may end in digits
+			r'|([A-Za-z]+[0-9]+)(?::([A-Za-z]+[0-9]+))?'             # reference or range
+			r'|([A-Za-z_]+)|(\S))')
+		_ops = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.truediv}
+
+		@_traced("formula")
+		def __init__(self, table: SpreadSheet.Table, source: str):
+			self.table = table
+			self.source = source
+			self.tokens, self.texts = self._tokenize(source[1:] if source.startswith("=") else source)
+			self.pos = 0
+			self._call = self._expr()
+			if self.pos != len(self.tokens):
+				self._unexpected(self.pos)
+			del self.tokens, self.texts, self.pos
+
+		def __call__(self):
+			return self._call()
+
+		def __repr__(self):
+			return f"Expression({self.source!r})"
+
+		@staticmethod
+		def aggregate(name, values):
+			# values is a flat list of cell values, non numbers (empty cells, text) are skipped
+			nums = [v for v in values if type(v) is int or type(v) is float]
+			match(name):
+				case "SUM":
+					return sum(nums)
+				case "AVG" | "AVERAGE":
+					return sum(nums) / len(nums) if nums else None
+				case "MIN":
+					return min(nums, default=0)
+				case "MAX":
+					return max(nums, default=0)
+				case "COUNT":
+					return len(nums)
+			raise ValueError(f"Unknown function: {name}")
+
+		@staticmethod
+		def parse_ref(ref: str):
+			col = ref.rstrip("0123456789").upper()
+			row = int(ref[len(col):])
+			if row < 1:
+				raise ValueError(f"Invalid cell reference: {ref}")
+			return excel_col_to_number(col) - 1, row - 1
+
+		def _tokenize(self, text):
+			# tokens are (kind, value), texts keeps the source text of each token for error messages
+			tokens = []
+			texts = []
+			for match in SpreadSheet.Expression._token.finditer(text):
+				number, string, function, ref, ref_end, name, op = match.groups()
+				texts.append(match.group().strip())
+				if number:
+					is_float = "." in number or "e" in number or "E" in number
+					tokens.append(("num", float(number) if is_float else int(number)))
+				elif function:
+					tokens.append(("name", function.upper()))
+				elif ref and ref_end:
+					tokens.append(("range", (SpreadSheet.Expression.parse_ref(ref), SpreadSheet.Expression.parse_ref(ref_end))))
+				elif ref:
+					tokens.append(("ref", SpreadSheet.Expression.parse_ref(ref)))
+				elif name:
+					tokens.append(("name", name.upper()))
+				elif op:
+					tokens.append(("op", op))
+				else:
+					tokens.append(("str", string))
+			return tokens, texts
+
+		def _unexpected(self, pos):
+			if pos >= len(self.tokens):
+				raise ValueError(f"Unexpected end of formula {self.source!r}")
+			raise ValueError(f"Unexpected {self.texts[pos]!r} in formula {self.source!r}")
+
+		def _peek(self):
+			return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+		def _expect(self, op):
+			if self._peek() != ("op", op):
+				raise ValueError(f"Expected {op!r} in formula {self.source!r}")
+			self.pos += 1
+
+		def _binary(self, ops, operand):
+			left = operand()
+			kind, tok = self._peek()
+			while kind == "op" and tok in ops:
+				self.pos += 1
+				fn, a, b = SpreadSheet.Expression._ops[tok], left, operand()
+				left = lambda fn=fn, a=a, b=b: fn(a(), b())
+				kind, tok = self._peek()
+			return left
+
+		def _expr(self):
+			return self._binary("+-", self._term)
+
+		def _term(self):
+			return self._binary("*/", self._unary)
+
+		def _unary(self):
+			kind, tok = self._peek()
+			if kind == "op" and tok in "+-":
+				self.pos += 1
+				inner = self._unary()
+				return inner if tok == "+" else (lambda: -inner())
+			return self._atom()
+
+		def _atom(self):
+			kind, tok = self._peek()
+			self.pos += 1
+			if kind in ("num", "str"):
+				return lambda: tok
+			if kind == "ref":
+				return self._cell(*tok)
+			if kind == "name":
+				return self._function(tok)
+			if (kind, tok) == ("op", "("):
+				inner = self._expr()
+				self._expect(")")
+				return inner
+			if kind == "range":
+				raise ValueError(f"Ranges are only allowed as function arguments: {self.source!r}")
+			self._unexpected(self.pos - 1)
+
+		def _cell(self, x, y):
+			table = self.table
+			def value():
+				if x < table.width and y < table.height:
+					val = table.data[x][y].value
+					return 0 if val is None else val
+				return 0
+			return value
+
+		def _range(self, start, end):
+			# rectangle reads are a single list comprehension over column slices
+			table = self.table
+			x0, x1 = sorted((start[0], end[0]))
+			y0, y1 = sorted((start[1], end[1]))
+			def values():
+				return [c.value for col in table.data[x0:x1 + 1] for c in col[y0:y1 + 1]]
+			return values
+
+		def _function(self, name):
+			aggregate = SpreadSheet.Expression.aggregate
+			aggregate(name, [])  # validate the name now rather than on first read
+			self._expect("(")
+			args = []
+			while self._peek() not in (("op", ")"), (None, None)):
+				if args:
+					self._expect(",")
+				kind, tok = self._peek()
+				if kind in ("range", "ref") and self.tokens[self.pos + 1:self.pos + 2] in ([], [("op", ",")], [("op", ")")]):
+					self.pos += 1
+					args.append(self._range(*tok) if kind == "range" else self._range(tok, tok))
+				else:
+					value = self._expr()
+					args.append(lambda value=value: [value()])
+			self._expect(")")
+			if len(args) == 1:
+				values = args[0]
+				return lambda: aggregate(name, values())
+			return lambda: aggregate(name, [v for arg in args for v in arg()])
+	class Aggregate:
+		# SUM/AVG/MIN/MAX/COUNT over a TableRange that keeps running state instead of rescanning:
+		# source cells push their writes here, so reading is O(1) and a write is O(log n) at most.
+		# formula results change without a write, so source cells holding a formula are kept apart
+		# and evaluated on every read, which then costs O(number of formula cells in the range).
+		# cells only hold weak references to their aggregates, unbind() detaches one right away,
+		# otherwise it stops being updated once nothing else references it
+		functions = ("SUM", "AVG", "MIN", "MAX", "COUNT")
+
+		def __init__(self, table_range: SpreadSheet.TableRange, function: str):
+			self.function = function.upper()
+			if self.function not in SpreadSheet.Aggregate.functions:
+				raise ValueError(f"Unknown aggregate: {function}")
+			self.ref = weakref.ref(self)  # what source cells hold
+			self.values = {}  # cell -> (value, seq) as currently counted
+			self.heap = []    # (key, seq, cell), stale entries are dropped lazily
+			self.volatile = set()  # source cells holding a formula
+			self.seq = 0
+			self.sum = 0             # exact sum of the int values
+			self.float_sum = 0       # exact sum of the finite float values, in units of 2**-1074
+			self.floats = 0          # finite float values counted in float_sum
+			self.special = {"inf": 0, "-inf": 0, "nan": 0}
+			self.count = 0
+			self.table_range = None
+			self.bind(table_range)
+
+		@_traced("aggregate")
+		def bind(self, table_range: SpreadSheet.TableRange):
+			# (re)bind to any range, O(size of both ranges); cells in both keep their state
+			cells = [cell for _, _, cell in table_range.superRange]
+			keep = set(cells)
+			for cell in [c for c in self.values if c not in keep]:
+				self.untrack(cell)
+			for cell in cells:
+				if cell not in self.values:
+					self.track(cell)
+			self.table_range = table_range
+			return self
+
+		@_traced("aggregate")
+		def slide(self, rows: int = 1):
+			# move a rolling window down (or up for rows < 0), only the rows leaving and
+			# entering the window are touched: O(rows * width * log n)
+			old = self.table_range
+			(x0, x1, xs), (y0, y1, ys) = old.x_slice, old.y_slice
+			if y0 + rows < 0:
+				raise ValueError(f"Cannot slide {old} by {rows} rows")
+			new = SpreadSheet.TableRange(old.table, slice(x0, x1, xs), slice(y0 + rows, y1 + rows, ys))
+			if rows % ys:
+				return self.bind(new)
+			old_rows, new_rows = range(y0, y1, ys), range(*new.y_slice)
+			k = min(abs(rows) // ys, len(old_rows))
+			leaving = old_rows[:k] if rows > 0 else old_rows[len(old_rows) - k:]
+			entering = new_rows[len(new_rows) - k:] if rows > 0 else new_rows[:k]
+			data = old.table.data
+			for y in leaving:
+				for x in range(x0, x1, xs):
+					self.untrack(data[x][y])
+			for y in entering:
+				for x in range(x0, x1, xs):
+					self.track(data[x][y])
+			self.table_range = new
+			return self
+
+		def unbind(self):
+			for cell in list(self.values):
+				self.untrack(cell)
+			self.table_range = None
+
+		def track(self, cell: SpreadSheet.Cell):
+			if cell.watchers is None:
+				cell.watchers = []
+			cell.watchers.append(self.ref)
+			self.values[cell] = (None, -1)
+			self.update(cell, cell.value)
+
+		def untrack(self, cell: SpreadSheet.Cell):
+			self._remove(cell)
+			del self.values[cell]
+			self.volatile.discard(cell)
+			cell.watchers.remove(self.ref)
+
+		def update(self, cell: SpreadSheet.Cell, value):
+			self._remove(cell)
+			if cell.formula is not None:
+				self.volatile.add(cell)
+				self.values[cell] = (None, -1)
+				return
+			self.volatile.discard(cell)
+			if type(value) is int or type(value) is float:
+				self._add(value, 1)
+				if self.function in ("MIN", "MAX"):
+					self.seq += 1
+					heapq.heappush(self.heap, (value if self.function == "MIN" else -value, self.seq, cell))
+					if len(self.heap) > 2 * len(self.values) + 16:
+						self._compact()
+				self.values[cell] = (value, self.seq)
+			else:
+				# -1 never matches a heap entry, so the cell's previous MIN/MAX entry goes stale
+				self.values[cell] = (value, -1)
+
+		def _remove(self, cell):
+			value, _ = self.values[cell]
+			if type(value) is int or type(value) is float:
+				self._add(value, -1)
+
+		def _add(self, value, sign):
+			# running totals must survive any number of writes without drift: ints are summed exactly, and
+			# every finite float is an integer multiple of 2**-1074, so floats are summed exactly as integers
+			# in that unit and rounded once when read. inf and nan are only counted
+			self.count += sign
+			if type(value) is int:
+				self.sum += sign * value
+			elif math.isfinite(value):
+				n, d = value.as_integer_ratio()
+				self.float_sum += sign * (n << (1074 - d.bit_length() + 1))
+				self.floats += sign
+			else:
+				self.special[repr(value)] += sign
+
+		def _total(self):
+			special = self.special
+			if special["nan"] or (special["inf"] and special["-inf"]):
+				return math.nan
+			if special["inf"] or special["-inf"]:
+				return math.inf if special["inf"] else -math.inf
+			if not self.floats:
+				return self.sum
+			# int / int true division is correctly rounded
+			return ((self.sum << 1074) + self.float_sum) / (1 << 1074)
+
+		def _valid(self, entry):
+			_, seq, cell = entry
+			return self.values.get(cell, (None, -1))[1] == seq
+
+		def _compact(self):
+			self.heap = [entry for entry in self.heap if self._valid(entry)]
+			heapq.heapify(self.heap)
+
+		def __call__(self):
+			extra = [v for v in (cell.value for cell in self.volatile) if type(v) is int or type(v) is float]
+			match(self.function):
+				case "SUM":
+					return self._total() + sum(extra) if extra else self._total()
+				case "AVG":
+					count = self.count + len(extra)
+					return (self._total() + sum(extra)) / count if count else None
+				case "COUNT":
+					return self.count + len(extra)
+			while self.heap and not self._valid(self.heap[0]):
+				heapq.heappop(self.heap)
+			if self.heap:
+				key = self.heap[0][0]
+				extra.append(key if self.function == "MIN" else -key)
+			if self.function == "MIN":
+				return min(extra, default=0)
+			return max(extra, default=0)
+
+		def __repr__(self):
+			return f"Aggregate({self.function}, {self.table_range})"
+	class Journal:
+		# bounded undo/redo log of range writes. Each TableRange or RecursiveAccessor assignment is one
+		# entry holding the range, the attribute path and the old and new values, stored as a single
+		# value when the whole range shares it. Undo and redo only touch (and mark dirty) those cells
+		def __init__(self, limit: int = 100, max_cells: int = 1_000_000):
+			self.limit = limit          # entries kept for undo
+			self.max_cells = max_cells  # stored per-cell values kept for undo
+			self.undo_stack = deque()
+			self.redo_stack = []
+			self.cells = 0
+
+		def clear(self):
+			self.undo_stack.clear()
+			self.redo_stack.clear()
+			self.cells = 0
+
+		missing = object()  # old value of an attribute the write created, undo deletes it again
+
+		@staticmethod
+		def _pack(values):
+			# 1, 1.0 and True compare equal but render differently, so the type has to match too
+			first = values[0] if values else None
+			kind = type(first)
+			if all(v is first or (type(v) is kind and v == first) for v in values):
+				return (True, first)
+			return (False, values)
+
+		def record(self, table_range: SpreadSheet.TableRange, path, new_values, nested=False):
+			# called before the write, nested means new_values is a [x][y] list as TableRange accepts
+			table = table_range.table
+			old = []
+			formulas = {}
+			for x in range(*table_range.x_slice):
+				for y in range(*table_range.y_slice):
+					cell = table.data[x][y]
+					target = cell
+					for attr in path[:-1]:
+						target = getattr(target, attr)
+					target = getattr(target, path[-1], SpreadSheet.Journal.missing)
+					if path == ("value",) and cell.formula is not None:
+						# keep the formula and the plain value underneath it, not the computed result
+						formulas[len(old)] = cell.formula
+						target = cell._value
+					old.append(target)
+			new = SpreadSheet.Journal._pack([v for col in new_values for v in col]) if nested else (True, new_values)
+			entry = (table, table_range.x_slice, table_range.y_slice, path, SpreadSheet.Journal._pack(old), new, formulas)
+			self.redo_stack.clear()
+			self.undo_stack.append(entry)
+			self.cells += SpreadSheet.Journal._size(entry)
+			while len(self.undo_stack) > 1 and (len(self.undo_stack) > self.limit or self.cells > self.max_cells):
+				self.cells -= SpreadSheet.Journal._size(self.undo_stack.popleft())
+
+		@staticmethod
+		def _size(entry):
+			_, _, _, _, (old_uniform, old), (new_uniform, new), formulas = entry
+			return (0 if old_uniform else len(old)) + (0 if new_uniform else len(new)) + len(formulas)
+
+		def _apply(self, entry, values, formulas):
+			table, x_slice, y_slice, path = entry[:4]
+			if x_slice[1] > table.width or y_slice[1] > table.height:
+				# entries hold absolute positions, a table that shrank since can not take them back
+				raise ValueError(f"Journal entry for {x_slice}x{y_slice} is outside the {table.width}x{table.height} table")
+			uniform, values = values
+			i = 0
+			for x in range(*x_slice):
+				for y in range(*y_slice):
+					cell = table.data[x][y]
+					value = values if uniform else values[i]
+					if i in formulas:
+						# put the plain value back quietly, setting the formula notifies watchers once
+						cell._value = value
+						cell.formula = formulas[i]
+					else:
+						target = cell
+						for attr in path[:-1]:
+							target = getattr(target, attr)
+						if value is SpreadSheet.Journal.missing:
+							if hasattr(target, path[-1]):
+								delattr(target, path[-1])
+						else:
+							setattr(target, path[-1], value)
+					cell.dirty = True
+					i += 1
+
+		def undo(self):
+			if not self.undo_stack:
+				return False
+			entry = self.undo_stack[-1]
+			self._apply(entry, entry[4], entry[6])
+			self.undo_stack.pop()
+			self.cells -= SpreadSheet.Journal._size(entry)
+			self.redo_stack.append(entry)
+			return True
+
+		def redo(self):
+			if not self.redo_stack:
+				return False
+			entry = self.redo_stack[-1]
+			self._apply(entry, entry[5], {})
+			self.redo_stack.pop()
+			self.undo_stack.append(entry)
+			self.cells += SpreadSheet.Journal._size(entry)
+			return True
+
 	class Table:
 		def __init__(self, width: int, height: int):
 			self.data = [[SpreadSheet.Cell() for _ in range(height)] for _ in range(width)]
 			self.width = width
 			self.height = height
 			self.server = None
+			self.journal = None  # SpreadSheet.Journal recording range writes for undo/redo
 	
 		def __getitem__(self, x):
 			if isinstance(x, int):
@@ -357,6 +856,7 @@ class SpreadSheet:
 			return "[\n\t" + ",\n\t".join(data) + "\n]"
 
 
+		@_traced("expand")
 		def _expand_to_include(self, x: int, y: int):
 			# Expand columns if needed
 			if x >= self.width:
@@ -376,7 +876,10 @@ class SpreadSheet:
 
 	
 	
+		@_traced("clean")
 		def clean(self):
+			if self.journal is not None:
+				self.journal.clear()  # recorded positions are meaningless once the cells move
 			min_x, max_x = self.width, -1
 			min_y, max_y = self.height, -1
 	
@@ -415,6 +918,7 @@ class SpreadSheet:
 		def __iter__(self) -> Iterator[Tuple[int, int, SpreadSheet.Cell]]:
 			return self[:][:].superRange
 
+		@_traced("clone")
 		def clone(self):
 			new_table = SpreadSheet.Table(self.width, self.height)
 			for x in range(self.width):
@@ -447,7 +951,14 @@ class SpreadSheet:
 				if not isinstance(cell_value, SpreadSheet.Cell):
 					raise ValueError("Assigned value must be a SpreadSheet.Cell")
 				# 🛠️ No clone here — just assign reference
+				old = self.table.data[x][y]
 				self.table.data[x][y] = cell_value
+				# aggregates watching this position follow the new cell
+				for ref in list(old.watchers or ()):
+					watcher = ref()
+					if watcher is not None:
+						watcher.untrack(old)
+						watcher.track(cell_value)
 			else:
 				raise NotImplementedError("Only integer index assignment is supported")
 
@@ -458,7 +969,7 @@ class SpreadSheet:
 	
 	class TableRange:
 		def __init__(self, table: SpreadSheet.Table, x_slice: Union[int, slice], y_slice: Union[int, slice]):
-			self.table = table
+			object.__setattr__(self, 'table', table)
 	
 			# Normalize int to slice
 			if isinstance(x_slice, int):
@@ -466,8 +977,8 @@ class SpreadSheet:
 			if isinstance(y_slice, int):
 				y_slice = slice(y_slice, y_slice + 1)
 			
-			self.x_slice = x_slice.start or 0, x_slice.stop or table.width,  x_slice.step or 1
-			self.y_slice = y_slice.start or 0, y_slice.stop or table.height, y_slice.step or 1
+			object.__setattr__(self, 'x_slice', (x_slice.start or 0, x_slice.stop or table.width,  x_slice.step or 1))
+			object.__setattr__(self, 'y_slice', (y_slice.start or 0, y_slice.stop or table.height, y_slice.step or 1))
 
 			self.table._expand_to_include(self.x_slice[1], self.y_slice[1])
 			
@@ -501,6 +1012,7 @@ class SpreadSheet:
 						 for y in range(*self.y_slice)]
 						 for x in range(*self.x_slice)]
 	
+		@_traced("set")
 		def __setattr__(self, prop, new_values: Any):
 			if prop in ('table', 'x_slice', 'y_slice'):
 				object.__setattr__(self, prop, new_values)
@@ -525,6 +1037,8 @@ class SpreadSheet:
 				rec = SpreadSheet.RecursiveAccessor(self, [prop])
 				rec.__setattr__(prop, new_values)
 			else:
+				if self.table.journal is not None:
+					self.table.journal.record(self, (prop,), new_values, nested=isinstance(new_values, list))
 				# Simple direct set of attribute on each cell
 				if isinstance(new_values, list):
 					for dx, x in enumerate(range(*self.x_slice)):
@@ -566,12 +1080,15 @@ class SpreadSheet:
 			# Return new RecursiveAccessor with extended attribute path
 			return RecursiveAccessor(self.table_range, self.attr_path + [name])
 	
+		@_traced("set")
 		def __setattr__(self, name, value):
 			# Internal attributes set normally
 			if name in ('table_range', 'attr_path'):
 				object.__setattr__(self, name, value)
 				return
 			full_path = self.attr_path + [name]
+			if self.table_range.table.journal is not None:
+				self.table_range.table.journal.record(self.table_range, tuple(full_path), value)
 	
 			for x in range(*self.table_range.x_slice):
 				for y in range(*self.table_range.y_slice):
@@ -608,177 +1125,188 @@ class SpreadSheet:
 			self.server = server
 			self.table = table if isinstance(table, SpreadSheet.Table) else SpreadSheet.Table(0, 0)
 			self.table.server = self.server
+	min_rect_cells = 8  # smallest uniform rectangle serialize() writes as one css rule
 	def __init__(self):
 		self.sheets = []
 		self.server = None
+	def memory_report(self):
+		# approximate bytes per sheet and component, objects shared between cells or sheets are
+		# counted once, where they are first met. Cell objects with their __dict__ count as "cells",
+		# values and formulas only count what cells actually hold. The dirty flags are shared bools,
+		# so dirty tracking is reported as a count of dirty cells rather than bytes
+		seen = set()
+		sheets = []
+		for sheet in self.sheets:
+			table = sheet.table
+			parts = {"grid": _sizeof(table.data, seen) + sum(_sizeof(col, seen) for col in table.data),
+				"cells": 0, "values": 0, "styles": 0, "formulas": 0}
+			count = 0
+			dirty = 0
+			for col in table.data:
+				for cell in col:
+					count += 1
+					dirty += cell.dirty
+					parts["cells"] += _sizeof(cell, seen)
+					if cell._value is not None:
+						parts["values"] += _sizeof(cell._value, seen)
+					style = cell.style
+					parts["styles"] += _sizeof(style, seen) + _sizeof(style.border, seen) + _sizeof(style.font, seen)
+					for value in (style.background, style.color, style.border.left, style.border.right, style.border.top,
+							style.border.bottom, style.font.size, style.font.family, style.font.modifiers):
+						parts["styles"] += _sizeof(value, seen)
+					parts["formulas"] += _sizeof_formula(cell.formula, seen)
+					if cell.watchers:
+						parts["formulas"] += _sizeof(cell.watchers, seen) + sum(_sizeof(ref, seen) + _sizeof_formula(ref(), seen) for ref in cell.watchers)
+			journal = table.journal
+			if journal is not None:
+				# entries hold the old/new value lists, the values themselves mostly live in cells too
+				parts["journal"] = _sizeof(journal, seen) + _sizeof(journal.undo_stack, seen) + _sizeof(journal.redo_stack, seen)
+				for entry in (*journal.undo_stack, *journal.redo_stack):
+					parts["journal"] += _sizeof(entry, seen) + sum(_sizeof(part, seen) + _sizeof(part[1], seen) for part in entry[4:6]) + _sizeof(entry[6], seen)
+			parts = {k: int(v) for k, v in parts.items()}
+			sheets.append({"name": sheet.name, "cells": count, "dirty": dirty, "bytes": parts, "total": sum(parts.values())})
+		return {"sheets": sheets, "total": sum(s["total"] for s in sheets)}
+
+	@_traced("createSheet")
 	def createSheet(self, name:str, table : SpreadSheet.Table = None):
 		self.sheets.append(SpreadSheet.Sheet(name, table, self.server))
 		if self.server is not None:
 			self.server.needs_reload = True
+	@_traced("payload")
+	def payload(self):
+		# columnar data for client side rendering: per sheet the cell texts column by column and
+		# run-length encoded style ids into a shared table of css declarations, 0 is the default style
+		default_key = _freeze_style(SpreadSheet.Style())
+		style_ids = {default_key: 0}
+		sheets = []
+		for sheet in self.sheets:
+			table = sheet.table
+			values = []
+			styles = []
+			for col in table.data:
+				texts = []
+				runs = []
+				for cell in col:
+					val = cell.value
+					texts.append(None if val is None else str(val))
+					skey = _freeze_style(cell.style)
+					sid = style_ids.get(skey)
+					if sid is None:
+						sid = style_ids[skey] = len(style_ids)
+					if runs and runs[-1][0] == sid:
+						runs[-1][1] += 1
+					else:
+						runs.append([sid, 1])
+				while texts and texts[-1] is None:
+					texts.pop()
+				values.append(texts)
+				styles.append(runs)
+			sheets.append({"name": sheet.name, "width": table.width, "height": table.height, "values": values, "styles": styles})
+		return {"styles": [_style_to_css(skey) for skey in style_ids], "sheets": sheets}
+
+	def shell(self, data_url="/data"):
+		# static page that builds the tables in the browser from payload() fetched at data_url
+		return f"<style>\n{_PAGE_CSS}</style>\n" + _CLIENT_SCRIPT.replace("DATA_URL", json.dumps(data_url))
+
+	@_traced("serialize")
 	def serialize(self):
-		def freeze_style(style):
-			return (
-				style.border.left,
-				style.border.right,
-				style.border.top,
-				style.border.bottom,
-				style.background,
-				style.color,
-				style.font.size,
-				style.font.family,
-				style.font.modifiers,
-			)
-
-		def style_to_css(style_key):
-			bl, br, bt, bb, bg, color, fsize, ffam, fmod = style_key
-			return (
-				f"background:{bg};"
-				f"color:{color};"
-				f"border-left:{bl};"
-				f"border-right:{br};"
-				f"border-top:{bt};"
-				f"border-bottom:{bb};"
-				f"font-family:{ffam};"
-				f"font-size:{fsize}px;"
-				f"font-style:{fmod};"
-			)
-		def number_to_excel_col(n):
-			result = ""
-			while n > 0:
-				n -= 1  # Adjust because Excel columns are 1-based but modulo is 0-based
-				result = chr((n % 26) + ord('A')) + result
-				n //= 26
-			return result
+		default_key = _freeze_style(SpreadSheet.Style())
 		global_styles = {}   # style_key -> 'S{num}'
-		next_global_id = 1
 
-		all_tables_html = []
-		all_tables_local_styles = []  # [(table_index, {style_key: SSclass})]
-		all_tables_local_classes_map = []  # to hold cell-to-class mappings per table
+		all_tables_classes_map = []  # cell-to-class mappings per table, None where the cell needs no class
+		column_rules = []            # (table_index, x, style_key)
+		rect_rules = []              # (table_index, x0, y0, x1, y1, style_key), end exclusive
+		interned = {default_key: default_key}
 
-		# First pass: assign global styles to known global pool, assign local styles otherwise
 		for table_index, sheet in enumerate(self.sheets, 1):
 			table = sheet.table
+			# equal styles share one key object, so the scans below compare with "is"
+			keys = [[interned.setdefault(k, k) for k in map(_freeze_style, (cell.style for cell in col))] for col in table.data]
 
-			local_styles = {}  # style_key -> 'SS{num}'
-			next_local_id = 1
-
-			# We'll store the classes assigned to each cell for possible replacement later
-			cell_classes = [[None]*table.height for _ in range(table.width)]
+			# the most common style of each column becomes an nth-child rule, cells matching it
+			# (or the default style, where that is the most common one) are written without a class
+			column_keys = []
+			for x, col in enumerate(keys):
+				key = Counter(col).most_common(1)[0][0] if col else default_key
+				if key is not default_key:
+					column_rules.append((table_index, x, key))
+				column_keys.append(key)
 
+			# uniform rectangles of cells that differ from their column get one rule instead of a class each,
+			# grown greedily: right along the row, then down while the whole row segment matches
+			covered = [[False]*table.height for _ in range(table.width)]
+			def free(x, y, skey):
+				return keys[x][y] is skey and skey is not column_keys[x] and not covered[x][y]
 			for y in range(table.height):
 				for x in range(table.width):
-					cell = table.data[x][y]
-					skey = freeze_style(cell.style)
+					skey = keys[x][y]
+					if not free(x, y, skey) or (x > 0 and free(x - 1, y, skey)):
+						continue
+					x1 = x + 1
+					while x1 < table.width and free(x1, y, skey):
+						x1 += 1
+					y1 = y + 1
+					while y1 < table.height and all(free(i, y1, skey) for i in range(x, x1)):
+						y1 += 1
+					if (x1 - x) * (y1 - y) >= SpreadSheet.min_rect_cells:
+						rect_rules.append((table_index, x, y, x1, y1, skey))
+						for i in range(x, x1):
+							covered[i][y:y1] = [True] * (y1 - y)
 
-					if skey in global_styles:
-						cls = global_styles[skey]
-					else:
-						if skey not in local_styles:
-							cls = f"SS{next_local_id}"
-							local_styles[skey] = cls
-							next_local_id += 1
-						else:
-							cls = local_styles[skey]
+			# Assign classes to the remaining cells in order of first appearance, sheet by sheet and row by row
+			cell_classes = [[None]*table.height for _ in range(table.width)]
+			for y in range(table.height):
+				for x in range(table.width):
+					skey = keys[x][y]
+					if skey is column_keys[x] or covered[x][y]:
+						continue
+					cls = global_styles.get(skey)
+					if cls is None:
+						cls = global_styles[skey] = f"S{len(global_styles) + 1}"
 					cell_classes[x][y] = cls
 
-			all_tables_local_styles.append((table_index, local_styles))
-			all_tables_local_classes_map.append(cell_classes)
-
-		# Second pass: check each table's local styles against global styles
-		# If local style matches a global style, replace all occurrences of that SS class with the S class
-		for idx, (table_index, local_styles) in enumerate(all_tables_local_styles):
-			# Reverse map from local class -> style_key
-			local_class_to_style = {v: k for k, v in local_styles.items()}
-
-			cell_classes = all_tables_local_classes_map[idx]
-
-			# For each local style in the table
-			for skey, ss_class in list(local_styles.items()):
-				if skey in global_styles:
-					# Replace local ss_class with global s_class in all cells for this table
-					s_class = global_styles[skey]
-					# Replace in cell_classes
-					for x in range(len(cell_classes)):
-						for y in range(len(cell_classes[0])):
-							if cell_classes[x][y] == ss_class:
-								cell_classes[x][y] = s_class
-					# Remove this local style, as it is now global
-					del local_styles[skey]
+			all_tables_classes_map.append(cell_classes)
 
-				else:
-					# This is a new unique style, so add to global_styles now to avoid duplicates in other tables later
-					global_styles[skey] = f"S{next_global_id}"
-					# Replace ss_class with the new global S class in all cells
-					new_global_class = global_styles[skey]
-					for x in range(len(cell_classes)):
-						for y in range(len(cell_classes[0])):
-							if cell_classes[x][y] == ss_class:
-								cell_classes[x][y] = new_global_class
-					del local_styles[skey]
-					next_global_id += 1
-
-			# Update the map after replacements
-			all_tables_local_classes_map[idx] = cell_classes
-
-		# Now generate final CSS and HTML with updated classes
-
-		# Compose global CSS
-		global_css = (
-			"body {margin: 0; display: flex; flex-direction: row; height: 100vh; }"
-			".TBCC {min-width: 0; display: flex; flex-direction: row; margin: 10px; }"
-			".TBC {overflow:auto;margin:10px;scrollbar-width:none;-ms-overflow-style:none;}"
-			".TBC::-webkit-scrollbar{display:none;}"
-			"table {border-collapse:collapse;position:relative;overflow:clip;}"
-			"thead th{position:sticky;top:0;background:#eee;z-index:5;border-right:1px solid #aaa;padding:4px 8px;}"
-			"thead th::after{content:\"\";position:absolute;left:0;bottom:0;height:3px;width:103%;background:#aaa;z-index:-1;}"
-			"thead th:first-child{left:0;z-index:10;background:#eee;position:sticky;top:0;left:0;}"
-			"thead th:first-child::before{content:\"\";position:absolute;top:0;right:0;width:3px;height:100%;background:#aaa;z-index:1;}"
-			"tbody th{position:sticky;left:0;z-index:4;background:#eee;min-width:40px;text-align:center;border-bottom:1px solid #aaa;padding:4px 8px;}"
-			"tbody th::before{content:\"\";position:absolute;top:0;right:0;width:3px;height:100%;background:#aaa;z-index:1;}"
-			"tbody td{white-space:nowrap;border-bottom:1px solid #ccc;padding:4px 8px;}"
-		)
-		for skey, cls in sorted(global_styles.items(), key=lambda i: int(i[1][1:])):
-			global_css += f".{cls} {{{style_to_css(skey)}}}\n"
-
-		# Compose per-table local CSS (now should be empty or minimal)
-		local_css_blocks = []
-		for table_index, local_styles in all_tables_local_styles:
-			css_block = ""
-			for skey, cls in local_styles.items():
-				css_block += f".TBC.{table_index} .{cls} {{{style_to_css(skey)}}}\n"
-			local_css_blocks.append(css_block)
+		# Now generate final CSS and HTML with the assigned classes.
+		# column rules have the specificity of "tbody td" and come after it, rectangle rules add the tr
+		# and beat column rules, cell classes beat all of them
+		global_css = _PAGE_CSS + f"tbody td{{{_style_to_css(default_key)}}}\n"
+		for table_index, x, skey in column_rules:
+			global_css += f":where(.T{table_index}) tbody td:where(:nth-child({x + 2})) {{{_style_to_css(skey)}}}\n"
+		for table_index, x0, y0, x1, y1, skey in rect_rules:
+			global_css += (f":where(.T{table_index}) tbody tr:where(:nth-child(n+{y0 + 1}):nth-child(-n+{y1}))"
+				f" td:where(:nth-child(n+{x0 + 2}):nth-child(-n+{x1 + 1})) {{{_style_to_css(skey)}}}\n")
+		for skey, cls in global_styles.items():
+			global_css += f".{cls} {{{_style_to_css(skey)}}}\n"
 
 		# Compose tables HTML
 		all_tables_html = []
+		escape = html.escape
 		for idx, sheet in enumerate(self.sheets):
 			table = sheet.table
 			table_index = idx + 1
-			cell_classes = all_tables_local_classes_map[idx]
-		
+
 			rows_html = []
-		
+
 			# Header row (empty top-left + column letters)
 			header_row = ['<th></th>'] + [
 				f'<th>{number_to_excel_col(x+1)}</th>' for x in range(table.width)
 			]
 			rows_html.append("<thead>\n\t<tr>" + "".join(header_row) + "</tr>\n\t</thead>\n\t<tbody>")
-		
+
 			# Data rows with row numbers
+			cell_classes = all_tables_classes_map[idx]
 			for y in range(table.height):
 				row_cells = [f'<th>{y + 1}</th>']
 				for x in range(table.width):
-					cell = table.data[x][y]
 					cls = cell_classes[x][y]
-					val = cell.value if cell.value is not None else ""
-					row_cells.append(f'<td class="{cls}" id="cell_{x}_{y}">{html.escape(str(val))}</td>')
+					val = table.data[x][y].value
+					text = escape("" if val is None else str(val))
+					row_cells.append(f'<td class="{cls}">{text}</td>' if cls else f'<td>{text}</td>')
 				rows_html.append("<tr>" + "".join(row_cells) + "</tr>")
-			all_tables_html.append(f'<div class="TBCC"><div class="TBC {table_index}"><table>\n' + "\n".join(rows_html) + "\n\t</tbody>\n</table></div></div>")
+			all_tables_html.append(f'<div class="TBCC"><div class="TBC {table_index}"><table class="T{table_index}">\n' + "\n".join(rows_html) + "\n\t</tbody>\n</table></div></div>")
 
 		style_tag = f"<style>\n{global_css}</style>\n"
-		for local_css in local_css_blocks:
-			if local_css.strip():
-				style_tag += f"<style>\n{local_css}</style>\n"
 
 		return style_tag + "\n".join(all_tables_html) + '<script>document.addEventListener("DOMContentLoaded",()=>{requestIdleCallback(()=>{let e=document.querySelectorAll(".TBC"),l=!1;e.forEach(r=>{r.addEventListener("scroll",()=>{if(l)return;l=!0;let o=r.scrollLeft,t=r.scrollTop;e.forEach(e=>{e!==r&&(e.scrollLeft=o,e.scrollTop=t)}),requestAnimationFrame(()=>{l=!1})})})})});</script>'
 '''
@@ -0,0 +1,267 @@
+from table import SpreadSheet
+
+def make_table(width=4, height=4):
+	sheet = SpreadSheet()
+	sheet.createSheet("test")
+	table = sheet.sheets[0].table
+	table._expand_to_include(width - 1, height - 1)
+	return sheet, table
+
+def raises(exc, fn, *args):
+	try:
+		fn(*args)
+	except exc as e:
+		return str(e)
+	raise AssertionError(f"{exc.__name__} not raised")
+
+def test_expression_arithmetic_and_refs():
+	_, table = make_table()
+	for y, v in enumerate([1, 2, 3, 4]):
+		table[0][y].value = v
+	E = lambda src: SpreadSheet.Expression(table, src)()
+	assert E("=(A1+A2)*-A3/2") == -4.5
+	assert E("1e3 + 2.5E-1") == 1000.25
+	assert E('"text"') == "text"
+	assert E("B1 + 1") == 1  # empty cells read as 0
+
+def test_expression_aggregates():
+	_, table = make_table()
+	for y, v in enumerate([1, 2, 3, 4]):
+		table[0][y].value = v
+	table[1][0].value = "x"
+	E = lambda src: SpreadSheet.Expression(table, src)()
+	assert E("SUM(A1:A4)") == 10
+	assert E("AVG(A1:A4)") == 2.5
+	assert E("MIN(A1:A4, -3)") == -3
+	assert E("MAX(A1:B4)") == 4
+	assert E("COUNT(A1:B4)") == 4
+	assert E("sum(A1, A2*10, B1)") == 21
+
+def test_expression_errors():
+	_, table = make_table()
+	E = lambda src: SpreadSheet.Expression(table, src)
+	assert raises(ValueError, E, "SUM(A1:A2") == "Expected ')' in formula 'SUM(A1:A2'"
+	assert raises(ValueError, E, "LOG10(A1)") == "Unknown function: LOG10"
+	assert raises(ValueError, E, "1 A1") == "Unexpected 'A1' in formula '1 A1'"
+	assert raises(ValueError, E, "A1 +") == "Unexpected end of formula 'A1 +'"
+	raises(ValueError, E, "A1:A2")
+	raises(ValueError, E, "A0")
+
+def test_formula_recompiles_on_change():
+	f = SpreadSheet.Formula(SpreadSheet.Formula.add, 1, 2)
+	assert f() == 3
+	f.op = SpreadSheet.Formula.mult
+	f.b = 5
+	assert f() == 5
+
+def test_aggregate_matches_rescan():
+	import random
+	rng = random.Random(7)
+	_, table = make_table(1, 200)
+	aggs = {f: SpreadSheet.Aggregate(table[0][0:200], f) for f in SpreadSheet.Aggregate.functions}
+	for i in range(3000):
+		table[0][rng.randrange(200)].value = rng.choice([rng.randint(-50, 50), rng.random(), None, "x"])
+		if i % 500 == 0:
+			table[0][rng.randrange(200)] = SpreadSheet.Cell(5)
+	values = [table.data[0][y].value for y in range(200)]
+	for f, agg in aggs.items():
+		expected = SpreadSheet.Expression.aggregate(f, values)
+		assert abs(agg() - expected) < 1e-9, (f, agg(), expected)
+
+def test_aggregate_sum_does_not_drift():
+	import math
+	_, table = make_table(1, 3)
+	for y, v in enumerate([1, 2, 3]):
+		table[0][y].value = v
+	total = SpreadSheet.Aggregate(table[0][0:3], "SUM")
+	table[0][0].value = 1e20
+	table[0][0].value = 1
+	assert total() == 6 and type(total()) is int
+	table[0][0].value = 0.1
+	table[0][1].value = 1e100
+	table[0][1].value = 0.2
+	table[0][2].value = -1e-300
+	assert total() == math.fsum([0.1, 0.2, -1e-300])
+	table[0][2].value = float("inf")
+	assert total() == float("inf")
+
+def test_aggregate_as_formula_operand_and_dropped():
+	import gc
+	_, table = make_table(1, 3)
+	for y, v in enumerate([1, 2, 3]):
+		table[0][y].value = v
+	total = SpreadSheet.Aggregate(table[0][0:3], "SUM")
+	assert SpreadSheet.Formula(SpreadSheet.Formula.add, total, 1)() == 7
+	del total
+	gc.collect()
+	table[0][0].value = 5  # the dropped aggregate is no longer notified
+	assert table.data[0][0].watchers is None
+	assert table.data[0][1].watchers[0]() is None
+
+def test_aggregate_max_after_non_numeric_write():
+	_, table = make_table(1, 3)
+	for y, v in enumerate([1, 2, 3]):
+		table[0][y].value = v
+	agg = SpreadSheet.Aggregate(table[0][0:3], "MAX")
+	table[0][2].value = 100
+	table[0][2].value = None
+	assert agg() == 2
+
+def test_aggregate_slide():
+	_, table = make_table(1, 20)
+	for y in range(20):
+		table[0][y].value = y
+	window = SpreadSheet.Aggregate(table[0][0:5], "SUM")
+	lowest = SpreadSheet.Aggregate(table[0][0:5], "MIN")
+	for _ in range(10):
+		window.slide()
+		lowest.slide()
+	assert (window(), lowest()) == (sum(range(10, 15)), 10)
+	window.slide(-3)
+	assert window() == sum(range(7, 12))
+
+def test_aggregate_formula_sources():
+	_, table = make_table(2, 2)
+	table[0][0].value = 5
+	table[1][0].value = 1
+	table[1][1].formula = SpreadSheet.Expression(table, "A1*10")
+	agg = SpreadSheet.Aggregate(table[1][0:2], "MAX")
+	assert agg() == 50
+	table[0][0].value = 7
+	assert agg() == 70
+	table[1][1].value = 2
+	assert agg() == 2
+
+def test_serialize_css_resolves_to_cell_styles():
+	# every cell must end up with its own style through the column, rectangle or class rules
+	import random, re
+	from table import _freeze_style, _style_to_css
+	rng = random.Random(1)
+	sheet = SpreadSheet()
+	for name in ("a", "b", "c"):
+		sheet.createSheet(name)
+		table = sheet.sheets[-1].table
+		table._expand_to_include(11, 29)
+		for _ in range(15):
+			x0, y0, w, h = rng.randrange(12), rng.randrange(30), rng.randint(1, 6), rng.randint(1, 8)
+			table[x0:x0 + w][y0:y0 + h].style.background = rng.choice(["#f00", "#0f0", "#00f"])
+		for _ in range(20):
+			table[rng.randrange(12)][rng.randrange(30)].style.color = rng.choice(["#123", "#456"])
+	out = sheet.serialize()
+	css = out[out.index("<style>"):out.index("</style>")]
+	default = re.search(r"tbody td\{(background:[^}]*)\}", css).group(1)
+	columns = {(int(t), int(c)): d for t, c, d in re.findall(r":where\(\.T(\d+)\) tbody td:where\(:nth-child\((\d+)\)\) \{([^}]*)\}", css)}
+	rects = [tuple(map(int, m[:5])) + (m[5],) for m in re.findall(
+		r":where\(\.T(\d+)\) tbody tr:where\(:nth-child\(n\+(\d+)\):nth-child\(-n\+(\d+)\)\) "
+		r"td:where\(:nth-child\(n\+(\d+)\):nth-child\(-n\+(\d+)\)\) \{([^}]*)\}", css)]
+	classes = dict(re.findall(r"\.(S\d+) \{([^}]*)\}", css))
+	assert columns and rects and classes
+	checked = 0
+	for t, html in enumerate(out.split('<table class="T')[1:], 1):
+		table = sheet.sheets[t - 1].table
+		for y, row in enumerate(re.findall(r"<tr><th>\d+</th>(.*?)</tr>", html)):
+			for x, (_, cls) in enumerate(re.findall(r'<td( class="(S\d+)")?>', row)):
+				if cls:
+					resolved = classes[cls]
+				else:
+					hits = [d for (tt, y0, y1, x0, x1, d) in rects if tt == t and y0 <= y + 1 <= y1 and x0 <= x + 2 <= x1]
+					resolved = hits[0] if hits else columns.get((t, x + 2), default)
+				assert resolved == _style_to_css(_freeze_style(table.data[x][y].style)), (t, x, y)
+				checked += 1
+	assert checked == sum(s.table.width * s.table.height for s in sheet.sheets)
+
+def test_journal_undo_redo():
+	_, table = make_table(3, 3)
+	journal = table.journal = SpreadSheet.Journal(limit=3)
+	table[0][0:3].value = 1
+	table[0:2][0:2].value = [[5, 6], [7, 8]]
+	table[0:2][0:1].style.background = "#f00"
+	for col in table.data:
+		for cell in col:
+			cell.dirty = False
+	assert journal.undo()
+	assert table[0:2][0:1].style.background == [["#ffffff"], ["#ffffff"]]
+	assert sorted((x, y) for x, y, cell in table if cell.dirty) == [(0, 0), (1, 0)]
+	assert journal.undo()
+	assert table[0:2][0:3].value == [[1, 1, 1], [None, None, None]]
+	assert journal.redo() and journal.redo()
+	assert table[0:2][0:2].value == [[5, 6], [7, 8]]
+	assert not journal.redo()
+
+def test_journal_is_bounded():
+	_, table = make_table(1, 1)
+	journal = table.journal = SpreadSheet.Journal(limit=3)
+	for i in range(10):
+		table[0][0].value = i
+	assert sum(journal.undo() for _ in range(10)) == 3
+	assert table.data[0][0].value == 6
+
+def test_journal_keeps_value_types():
+	_, table = make_table(1, 2)
+	table.data[0][0].value = 1
+	table.data[0][1].value = 1.0
+	table.journal = SpreadSheet.Journal()
+	table[0][0:2].value = 5
+	table.journal.undo()
+	assert [type(v) for v in table[0][0:2].value[0]] == [int, float]
+
+def test_journal_style_assignment():
+	_, table = make_table(1, 1)
+	table.journal = SpreadSheet.Journal()
+	table[0][0].style = SpreadSheet.Style()  # must not raise with a journal attached
+	table.journal.undo()
+
+def test_journal_formula_undo_updates_aggregates():
+	_, table = make_table(2, 2)
+	table.journal = SpreadSheet.Journal()
+	table.data[0][0].value = 3
+	table.data[1][0].value = 1
+	table.data[1][1].formula = SpreadSheet.Expression(table, "A1*10")
+	agg = SpreadSheet.Aggregate(table[1][0:2], "SUM")
+	table[1][1].value = 7
+	assert agg() == 8
+	table.journal.undo()
+	assert table.data[1][1].formula is not None
+	assert agg() == 31
+
+def test_journal_cleared_by_clean():
+	_, table = make_table(4, 4)
+	journal = table.journal = SpreadSheet.Journal()
+	table[3][3].value = 1
+	table.clean()
+	assert not journal.undo()
+	table.journal = journal = SpreadSheet.Journal()
+	table[0][0].value = 2
+	table.width = 0  # shrunk without going through clean
+	assert "outside" in raises(ValueError, journal.undo)
+	assert len(journal.undo_stack) == 1  # the entry is kept when undo fails
+
+def test_memory_report():
+	sheet, table = make_table(10, 10)
+	report = sheet.memory_report()["sheets"][0]
+	assert report["cells"] == 100
+	assert report["bytes"]["values"] == 0 and report["bytes"]["formulas"] == 0
+	assert report["total"] == sum(report["bytes"].values())
+	table[0][0].value = "some text"
+	table[1][0].formula = SpreadSheet.Expression(table, "SUM(A1:A10)")
+	report = sheet.memory_report()["sheets"][0]
+	assert report["bytes"]["values"] > 0 and report["bytes"]["formulas"] > 0
+
+def test_trace_memory():
+	from table import trace_memory
+	sheet, table = make_table(2, 2)
+	with trace_memory() as outer:
+		table[0][0].value = 1
+		with trace_memory() as inner:
+			table[0:2][0:2].style = SpreadSheet.Style()  # TableRange delegates to RecursiveAccessor
+		table[1][1].value = 2
+		sheet.serialize()
+	assert inner["set"][0] == 1
+	assert outer["set"][0] == 2  # the outer trace keeps counting after the inner one exits
+	assert outer["serialize"][0] == 1
+
+if __name__ == "__main__":
+	for name, test in list(globals().items()):
+		if name.startswith("test_"):
+			test()
+			print("ok", name)